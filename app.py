@@ -1,19 +1,121 @@
+import os
+import numpy as np
 import streamlit as st
 import pandas as pd
 from datetime import datetime, time
-import altair as alt
+
+DATA_FILE = 'headache_data.parquet'
+LEGACY_CSV_FILE = 'headache_data.csv'
+COLUMNS = ['Date', 'Start Time', 'End Time', 'Duration', 'Severity', 'Remarks', 'Location', 'Total Minutes']
+LOCATIONS = ['左侧', '右侧', '双侧']
+SEVERITY_LEVELS = [1, 2, 3, 4, 5]
+SEVERITY_DTYPE = pd.CategoricalDtype(SEVERITY_LEVELS, ordered=True)
+LOCATION_DTYPE = pd.CategoricalDtype(LOCATIONS)
+WEEKDAY_DTYPE = pd.CategoricalDtype(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], ordered=True)
+DATETIME_FORMATS = {'Date': '%Y-%m-%d', 'Start Time': '%Y-%m-%d %H:%M', 'End Time': '%Y-%m-%d %H:%M'}
+DURATION_BIN_EDGES = np.array([30, 60, 120], dtype=np.float32)
+DURATION_BIN_LABELS = ['0-30分钟', '30-60分钟', '60-120分钟', '120分钟以上']
+
+# 将“X小时Y分钟”格式的持续时间解析为分钟数
+def parse_duration_minutes(duration):
+    parts = duration.str.extract(r'(\d+)小时(\d+)分钟').astype('float')
+    return parts[0] * 60 + parts[1]
+
+# 读取旧版 CSV 数据，显式指定列类型以跳过类型推断，并补全缺失的 Total Minutes
+def read_legacy_csv():
+    data = pd.read_csv(
+        LEGACY_CSV_FILE,
+        usecols=lambda column: column in COLUMNS,
+        dtype={'Total Minutes': 'float32', 'Location': 'string', 'Duration': 'string'},
+        encoding='utf-8-sig',
+    )
+    if 'Duration' in data.columns and ('Total Minutes' not in data.columns or data['Total Minutes'].isna().any()):
+        minutes = parse_duration_minutes(data['Duration'])
+        data['Total Minutes'] = data.get('Total Minutes', minutes).fillna(minutes)
+    return data
+
+# 严重程度固定使用 1-5 作为有序分类，旧数据中手动输入的其他数值一并加入并排序，避免转换时丢失
+def severity_dtype(severity):
+    extra = set(severity.dropna()) - set(SEVERITY_LEVELS)
+    return pd.CategoricalDtype(sorted(SEVERITY_LEVELS + list(extra)), ordered=True) if extra else SEVERITY_DTYPE
+
+# 部位列固定使用表单中的选项作为分类，旧数据中的其他取值追加在后，避免转换时丢失
+def location_dtype(location):
+    extra = sorted(set(location.dropna().astype(str)) - set(LOCATIONS))
+    return pd.CategoricalDtype(LOCATIONS + extra) if extra else LOCATION_DTYPE
+
+# 按固定格式将日期时间列解析为 datetime64；无法解析的值置为空值，原内容追加到备注中，
+# 返回这些值的说明供页面提示
+def parse_datetimes(data):
+    invalid = []
+    for column, fmt in DATETIME_FORMATS.items():
+        if column not in data.columns or pd.api.types.is_datetime64_any_dtype(data[column]):
+            continue
+        parsed = pd.to_datetime(data[column], format=fmt, errors='coerce')
+        bad = parsed.isna() & data[column].notna()
+        if bad.any():
+            originals = data.loc[bad, column].astype(str)
+            invalid += [f"第 {row + 1} 行 {column}: {value}" for row, value in originals.items()]
+            if 'Remarks' in data.columns:
+                remarks = data.loc[bad, 'Remarks'].fillna('').astype(str)
+                data['Remarks'] = data['Remarks'].astype(object)
+                data.loc[bad, 'Remarks'] = (remarks + f' 原{column}: ' + originals).str.strip()
+        data[column] = parsed
+    return invalid
+
+# 取值有限的列使用分类类型以减少内存占用并加快计数
+# 只转换数据中存在的列，缺失的列留给图表部分提示
+def apply_dtypes(data):
+    dtypes = {}
+    if 'Severity' in data.columns:
+        dtypes['Severity'] = severity_dtype(data['Severity'])
+    if 'Location' in data.columns:
+        dtypes['Location'] = location_dtype(data['Location'])
+    return data.astype({column: dtype for column, dtype in dtypes.items() if column in data.columns})
+
+# 读取数据文件，按文件修改时间缓存，文件未变化时直接从内存返回
+@st.cache_data(show_spinner=False)
+def read_data_file(mtime):
+    migrate = False
+    if os.path.exists(DATA_FILE):
+        data = pd.read_parquet(DATA_FILE)
+    elif os.path.exists(LEGACY_CSV_FILE):
+        # 首次运行时将旧版 CSV 数据迁移为 Parquet
+        data = read_legacy_csv()
+        migrate = True
+    else:
+        data = pd.DataFrame(columns=COLUMNS)
+    invalid = parse_datetimes(data)
+    if invalid:
+        st.error('以下日期时间无法识别，已置为空值并将原内容记入备注，请在编辑模式下修正：\n\n' + '\n\n'.join(invalid))
+    data = apply_dtypes(data)
+    if migrate:
+        data.to_parquet(DATA_FILE, compression='zstd', index=False)
+    return data
 
 # 加载数据
 def load_data():
     try:
-        data = pd.read_csv('headache_data.csv')
-    except FileNotFoundError:
-        data = pd.DataFrame(columns=['Date', 'Start Time', 'End Time', 'Duration', 'Severity', 'Remarks', 'Location', 'Total Minutes'])
-    return data
+        mtime = os.path.getmtime(DATA_FILE)
+    except OSError:
+        mtime = None
+    return read_data_file(mtime)
 
 # 保存数据
 def save_data(data):
-    data.to_csv('headache_data.csv', index=False, encoding='utf-8-sig')
+    data.to_parquet(DATA_FILE, compression='zstd', index=False)
+    read_data_file.clear()
+
+# 追加单条记录（Parquet 不支持追加写入，需与已有数据合并后整体写回）
+def append_record(record):
+    data = load_data()
+    new_record = pd.DataFrame([record], columns=COLUMNS)
+    data = new_record if data.empty else pd.concat([data, new_record], ignore_index=True)
+    save_data(data)
+
+# 格式化日期时间用于显示，空值显示为 -
+def format_datetime(value, fmt='%Y-%m-%d %H:%M'):
+    return value.strftime(fmt) if pd.notna(value) else '-'
 
 # 计算持续时间并格式化为小时分钟
 def calculate_duration(start_time, end_time):
@@ -22,172 +124,209 @@ def calculate_duration(start_time, end_time):
     hours, minutes = divmod(total_minutes, 60)
     return f"{int(hours)}小时{int(minutes)}分钟", total_minutes
 
-# 侧边栏内容
-st.sidebar.title('头痛记录系统')
+# 柱状图的 Vega-Lite 定义
+def bar_chart_spec(field, title):
+    return {
+        'title': title,
+        'mark': 'bar',
+        'encoding': {
+            'x': {'field': field, 'type': 'ordinal'},
+            'y': {'field': 'Count', 'type': 'quantitative'},
+        },
+    }
+
+# 各图表的 Vega-Lite 定义，直接交给 st.vega_lite_chart，省去 Altair 的构建和校验开销
+SEVERITY_LINE_SPEC = {
+    'title': '头痛严重程度随时间变化图',
+    'mark': 'line',
+    'encoding': {
+        'x': {'field': 'Date', 'type': 'temporal', 'axis': {'format': '%Y-%m-%d'}},
+        'y': {'field': 'Severity', 'type': 'quantitative'},
+    },
+}
+MONTH_BAR_SPEC = bar_chart_spec('Month', '按月份统计头痛次数')
+WEEKDAY_BAR_SPEC = bar_chart_spec('Weekday', '按星期几统计头痛次数')
+DURATION_BAR_SPEC = bar_chart_spec('Duration Bin', '头痛持续时间分布')
+SEVERITY_PIE_SPEC = {
+    'title': '按严重程度分布',
+    'mark': 'arc',
+    'encoding': {
+        'theta': {'field': 'Count', 'type': 'quantitative'},
+        'color': {'field': 'Severity', 'type': 'nominal'},
+    },
+}
+LOCATION_BAR_SPEC = bar_chart_spec('Location', '头痛部位分布')
+
+# 按分类编码直接计数（bincount），避免对每个值做哈希，空值不计入
+def count_categories(values, name):
+    codes = np.asarray(values.codes)
+    counts = np.bincount(codes[codes >= 0], minlength=len(values.categories))
+    return pd.DataFrame({name: values.categories, 'Count': counts})
+
+# 头痛严重程度随时间变化的折线图，按天取平均值后再绘制
+def build_severity_chart(data):
+    return data['Severity'].astype('float32').groupby(data['Date'].dt.normalize()).mean().reset_index()
+
+# 按月份统计头痛次数的柱状图，对月份的整数序号排序后计数
+def build_month_chart(data):
+    months = data['Date'].dt.to_period('M').array
+    ordinals, counts = np.unique(months.asi8[~months.isna()], return_counts=True)
+    return pd.DataFrame({'Month': pd.PeriodIndex.from_ordinals(ordinals, freq='M').astype(str), 'Count': counts})
+
+# 按星期几统计头痛次数的条形图
+def build_weekday_chart(data):
+    weekdays = pd.Categorical.from_codes(data['Date'].dt.dayofweek.fillna(-1).astype('int8'), dtype=WEEKDAY_DTYPE)
+    return count_categories(weekdays, 'Weekday')
+
+# 头痛持续时间分布的柱状图，用 searchsorted + bincount 一次完成分箱计数
+def build_duration_chart(data):
+    minutes = data['Total Minutes'].to_numpy(np.float32, na_value=np.nan)
+    minutes = minutes[minutes >= 0]
+    counts = np.bincount(np.searchsorted(DURATION_BIN_EDGES, minutes, side='right'), minlength=len(DURATION_BIN_LABELS))
+    return pd.DataFrame({'Duration Bin': DURATION_BIN_LABELS, 'Count': counts})
+
+# 按严重程度分布的饼图
+def build_severity_pie_chart(data):
+    return count_categories(data['Severity'].array, 'Severity')
+
+# 头痛部位分析的条形图，先按分类计数，再把组合部位拆分后累加
+def build_location_chart(data):
+    location_counts = count_categories(data['Location'].array, 'Location')
+    location_counts['Location'] = location_counts['Location'].str.split(', ')
+    return location_counts.explode('Location').groupby('Location', sort=False)['Count'].sum().reset_index()
+
+# 图表类型 -> (数据聚合函数, Vega-Lite 定义)，图表选择框的选项也来自这里
+CHARTS = {
+    '头痛严重程度随时间变化': (build_severity_chart, SEVERITY_LINE_SPEC),
+    '按月份统计头痛次数': (build_month_chart, MONTH_BAR_SPEC),
+    '按星期几统计头痛次数': (build_weekday_chart, WEEKDAY_BAR_SPEC),
+    '头痛持续时间分布': (build_duration_chart, DURATION_BAR_SPEC),
+    '按严重程度分布': (build_severity_pie_chart, SEVERITY_PIE_SPEC),
+    '头痛部位分布': (build_location_chart, LOCATION_BAR_SPEC),
+}
+
+# 按图表类型聚合数据，数据未变化时直接使用缓存；只需保留当前数据下每种图表各一份
+@st.cache_data(show_spinner=False, max_entries=len(CHARTS))
+def build_chart_data(chart_type, data):
+    builder, _ = CHARTS[chart_type]
+    chart_data = builder(data)
+    if 'Count' in chart_data.columns:
+        chart_data = chart_data.astype({'Count': 'int32'})
+    return chart_data
 
 # 添加头痛记录
-st.sidebar.header('添加头痛记录')
-with st.sidebar.form('headache_form'):
-    # 默认时间设置为 00:00
-    default_time = time(0, 0)
-    
-    # 日期选择器
-    date = st.date_input('日期', datetime.now().date())
-    
-    # 时间选择器，默认时间为 00:00
-    start_time = st.time_input('头痛开始时间', value=default_time)
-    end_time = st.time_input('头痛结束时间', value=default_time)
-
-    # 其他表单字段
-    severity = st.slider('严重程度', 1, 5, 1)
-    remarks = st.text_area('备注')
-    location = st.radio('头痛部位', ['左侧', '右侧', '双侧'])
-    
-    # 提交按钮
-    submitted = st.form_submit_button('添加记录')
-    
-    if submitted:
-        try:
-            if date and start_time and end_time:
-                start_datetime = datetime.combine(date, start_time)
-                end_datetime = datetime.combine(date, end_time)
-                if start_datetime > end_datetime:
-                    st.sidebar.error('结束时间不能早于开始时间')
+def render_add_form():
+    st.sidebar.header('添加头痛记录')
+    with st.sidebar.form('headache_form'):
+        # 默认时间设置为 00:00
+        default_time = time(0, 0)
+
+        # 日期选择器
+        date = st.date_input('日期', datetime.now().date())
+
+        # 时间选择器，默认时间为 00:00
+        start_time = st.time_input('头痛开始时间', value=default_time)
+        end_time = st.time_input('头痛结束时间', value=default_time)
+
+        # 其他表单字段
+        severity = st.slider('严重程度', 1, 5, 1)
+        remarks = st.text_area('备注')
+        location = st.radio('头痛部位', LOCATIONS)
+
+        # 提交按钮
+        submitted = st.form_submit_button('添加记录')
+
+        if submitted:
+            try:
+                if date and start_time and end_time:
+                    start_datetime = datetime.combine(date, start_time)
+                    end_datetime = datetime.combine(date, end_time)
+                    if start_datetime > end_datetime:
+                        st.sidebar.error('结束时间不能早于开始时间')
+                    else:
+                        duration, total_minutes = calculate_duration(start_datetime, end_datetime)
+                        append_record({
+                            'Date': pd.Timestamp(date),
+                            'Start Time': pd.Timestamp(start_datetime),
+                            'End Time': pd.Timestamp(end_datetime),
+                            'Duration': duration,
+                            'Severity': severity,
+                            'Remarks': remarks,
+                            'Location': location,
+                            'Total Minutes': total_minutes,
+                        })
+                        st.sidebar.success('记录已添加')
                 else:
-                    duration, total_minutes = calculate_duration(start_datetime, end_datetime)
-                    new_record = pd.DataFrame([[date, start_datetime.strftime('%Y-%m-%d %H:%M'), end_datetime.strftime('%Y-%m-%d %H:%M'), duration, severity, remarks, location, total_minutes]],
-                                              columns=['Date', 'Start Time', 'End Time', 'Duration', 'Severity', 'Remarks', 'Location', 'Total Minutes'])
-                    data = load_data()
-                    data = pd.concat([data, new_record], ignore_index=True)
-                    save_data(data)
-                    st.sidebar.success('记录已添加')
-            else:
-                st.sidebar.error('请确保所有字段都已正确填写')
-        except ValueError:
-            st.sidebar.error('时间格式错误，请检查输入时间')
+                    st.sidebar.error('请确保所有字段都已正确填写')
+            except ValueError:
+                st.sidebar.error('时间格式错误，请检查输入时间')
 
 # 删除头痛记录
-st.sidebar.header('删除头痛记录')
-data = load_data()
-if not data.empty:
-    record_to_delete = st.sidebar.selectbox('选择要删除的记录', data.index, format_func=lambda x: f"日期: {data.loc[x, 'Date']} 开始时间: {data.loc[x, 'Start Time']} 结束时间: {data.loc[x, 'End Time']}")
-    if st.sidebar.button('删除记录'):
-        data = data.drop(record_to_delete).reset_index(drop=True)
-        save_data(data)
-        st.sidebar.success('记录已删除')
-        st.rerun()  # 刷新应用
+def render_delete(data):
+    st.sidebar.header('删除头痛记录')
+    if not data.empty:
+        record_to_delete = st.sidebar.selectbox('选择要删除的记录', data.index, format_func=lambda x: f"日期: {format_datetime(data.loc[x, 'Date'], '%Y-%m-%d')} 开始时间: {format_datetime(data.loc[x, 'Start Time'])} 结束时间: {format_datetime(data.loc[x, 'End Time'])}")
+        if st.sidebar.button('删除记录'):
+            save_data(data.drop(record_to_delete).reset_index(drop=True))
+            st.sidebar.success('记录已删除')
+            st.rerun()  # 刷新应用
 
 # 选择要显示的图表类型
-st.sidebar.header('选择图表')
-chart_type = st.sidebar.selectbox(
-    '选择图表类型',
-    ['头痛严重程度随时间变化', '按月份统计头痛次数', '按星期几统计头痛次数', '头痛持续时间分布', '按严重程度分布', '头痛部位分布']
-)
+def render_chart_select():
+    st.sidebar.header('选择图表')
+    return st.sidebar.selectbox('选择图表类型', list(CHARTS))
+
+# 生成下载用的 CSV（带 BOM，便于 Excel 识别中文），数据未变化时直接使用缓存
+# 开始/结束时间保持旧版 CSV 的 YYYY-MM-DD HH:MM 格式，只需保留当前数据的一份
+@st.cache_data(show_spinner=False, max_entries=2)
+def to_csv_bytes(data):
+    data = data.assign(**{column: data[column].dt.strftime('%Y-%m-%d %H:%M') for column in ['Start Time', 'End Time'] if column in data.columns})
+    return data.to_csv(index=False).encode('utf-8-sig')
 
 # 下载数据
-st.sidebar.header('下载数据')
-if not data.empty:
-    csv = data.to_csv(index=False, encoding='utf-8-sig').encode('utf-8-sig')
-    st.sidebar.download_button(
-        label="下载CSV",
-        data=csv,
-        file_name='headache_data.csv',
-        mime='text/csv',
-    )
+def render_download(data):
+    st.sidebar.header('下载数据')
+    if not data.empty:
+        st.sidebar.download_button(
+            label="下载CSV",
+            data=to_csv_bytes(data),
+            file_name='headache_data.csv',
+            mime='text/csv',
+        )
 
 # 显示头痛记录
-st.header('头痛记录列表')
-if not data.empty:
-    edited_data = st.data_editor(data, use_container_width=True)
-    if st.button('更新记录'):
-        save_data(edited_data)
-        st.success('记录已更新')
+def render_list(data):
+    st.header('头痛记录列表')
+    if not data.empty:
+        # 仅在编辑模式下使用 data_editor，平时用更轻量的 dataframe 展示
+        if st.checkbox('编辑模式'):
+            edited_data = st.data_editor(data, use_container_width=True, hide_index=True)
+            if st.button('更新记录'):
+                save_data(edited_data)
+                st.success('记录已更新')
+        else:
+            st.dataframe(data, use_container_width=True, hide_index=True)
 
 # 数据可视化
-st.header('数据可视化')
-if not data.empty:
-    data['Date'] = pd.to_datetime(data['Date'])
-
-    if chart_type == '头痛严重程度随时间变化':
-        # 头痛严重程度随时间变化的折线图
-        chart1 = alt.Chart(data).mark_line().encode(
-            x=alt.X('Date:T', axis=alt.Axis(format='%Y-%m-%d')),
-            y='Severity:Q'
-        ).properties(
-            title='头痛严重程度随时间变化图'
-        )
-        st.altair_chart(chart1, use_container_width=True)
-
-    elif chart_type == '按月份统计头痛次数':
-        # 按月份统计头痛次数的柱状图
-        data['Month'] = data['Date'].dt.strftime('%Y-%m')
-        month_counts = data['Month'].value_counts().reset_index()
-        month_counts.columns = ['Month', 'Count']
-        chart2 = alt.Chart(month_counts).mark_bar().encode(
-            x='Month:O',
-            y='Count:Q'
-        ).properties(
-            title='按月份统计头痛次数'
-        )
-        st.altair_chart(chart2, use_container_width=True)
-
-    elif chart_type == '按星期几统计头痛次数':
-        # 按星期几统计头痛次数的条形图
-        data['Weekday'] = data['Date'].dt.day_name()
-        weekday_counts = data['Weekday'].value_counts().reset_index()
-        weekday_counts.columns = ['Weekday', 'Count']
-        chart3 = alt.Chart(weekday_counts).mark_bar().encode(
-            x='Weekday:O',
-            y='Count:Q'
-        ).properties(
-            title='按星期几统计头痛次数'
-        )
-        st.altair_chart(chart3, use_container_width=True)
-
-    elif chart_type == '头痛持续时间分布':
-        # 头痛持续时间分布的柱状图
-        if 'Duration' in data.columns:
-            data['Duration Minutes'] = data['Duration'].apply(lambda x: int(x.split('小时')[0]) * 60 + int(x.split('小时')[1].replace('分钟', '')))
-            bins = [0, 30, 60, 120, float('inf')]
-            labels = ['0-30分钟', '30-60分钟', '60-120分钟', '120分钟以上']
-            data['Duration Bin'] = pd.cut(data['Duration Minutes'], bins=bins, labels=labels, right=False)
-            duration_counts = data['Duration Bin'].value_counts().reset_index()
-            duration_counts.columns = ['Duration Bin', 'Count']
-            chart4 = alt.Chart(duration_counts).mark_bar().encode(
-                x='Duration Bin:O',
-                y='Count:Q'
-            ).properties(
-                title='头痛持续时间分布'
-            )
-            st.altair_chart(chart4, use_container_width=True)
-        else:
-            st.error("'Duration' 列缺失，请检查数据")
-
-    elif chart_type == '按严重程度分布':
-        # 按严重程度分布的饼图
-        severity_counts = data['Severity'].value_counts().reset_index()
-        severity_counts.columns = ['Severity', 'Count']
-        chart5 = alt.Chart(severity_counts).mark_arc().encode(
-            theta='Count:Q',
-            color='Severity:N'
-        ).properties(
-            title='按严重程度分布'
-        )
-        st.altair_chart(chart5, use_container_width=True)
-
-    elif chart_type == '头痛部位分布':
-        # 头痛部位分析的条形图
-        if 'Location' in data.columns:
-            # 处理双侧情况
-            location_expanded = data['Location'].apply(lambda loc: loc.split(', ')).explode()
-            location_data = location_expanded.value_counts().reset_index()
-            location_data.columns = ['Location', 'Count']
-            chart6 = alt.Chart(location_data).mark_bar().encode(
-                x='Location:O',
-                y='Count:Q'
-            ).properties(
-                title='头痛部位分布'
-            )
-            st.altair_chart(chart6, use_container_width=True)
+def render_viz(data, chart_type):
+    st.header('数据可视化')
+    if not data.empty:
+        try:
+            chart_data = build_chart_data(chart_type, data)
+        except KeyError as e:
+            st.error(f"{e} 列缺失，请检查数据")
         else:
-            st.error("'Location' 列缺失，请检查数据")
+            _, spec = CHARTS[chart_type]
+            st.vega_lite_chart(chart_data, spec, use_container_width=True)
+
+# 侧边栏内容
+st.sidebar.title('头痛记录系统')
+
+# 新记录需在加载数据前写入，之后各部分共用同一份数据
+render_add_form()
+data = load_data()
+render_delete(data)
+chart_type = render_chart_select()
+render_download(data)
+render_list(data)
+render_viz(data, chart_type)